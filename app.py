@@ -1,20 +1,47 @@
-from flask import Flask, render_template, request, send_from_directory
+from flask import Flask, render_template, request, redirect, send_from_directory
+from flask_login import LoginManager, UserMixin, login_user, logout_user, login_required, current_user
+from werkzeug.security import generate_password_hash, check_password_hash
 from werkzeug.utils import secure_filename
 
+from jinja2 import FileSystemBytecodeCache
+from markupsafe import escape
+
 from reportlab.lib.pagesizes import A4
 from reportlab.pdfgen import canvas
 
-from pydub import AudioSegment
-
+import bisect
+import hashlib
+import json
+import math
 import os
-import speech_recognition as sr
-from textblob import TextBlob
+import queue
+import re
+import sqlite3
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from faster_whisper import WhisperModel
+from vaderSentiment.vaderSentiment import SentimentIntensityAnalyzer
 
 
 # ---------------- APP CONFIG ----------------
 
 app = Flask(__name__)
 
+app.secret_key = os.environ.get("SECRET_KEY")
+
+if not app.secret_key:
+
+    if __name__ == "__main__":
+        # Local dev server only: sessions reset on every restart
+        app.secret_key = os.urandom(32)
+
+    else:
+        raise RuntimeError("SECRET_KEY must be set (it signs the session cookies)")
+
 UPLOAD_FOLDER = "uploads"
 STATIC_FOLDER = "static"
 
@@ -23,120 +50,431 @@ os.makedirs(STATIC_FOLDER, exist_ok=True)
 
 app.config["UPLOAD_FOLDER"] = UPLOAD_FOLDER
 
+# When fronted by nginx/Apache with X-Sendfile support, hand audio
+# downloads to the web server's sendfile(2) path instead of streaming
+# the bytes through Python.
+app.config["USE_X_SENDFILE"] = os.environ.get("USE_X_SENDFILE") == "1"
+
+# Persist compiled templates so template compilation is paid once per
+# template, not once per process restart.
+app.jinja_env.bytecode_cache = FileSystemBytecodeCache()
+
+
+# ---------------- DATABASE ----------------
+
+DB_PATH = "users.db"
+
+# One connection per thread, opened once and reused for the lifetime of the
+# worker. WAL mode lets readers run while a writer commits, so we never pay
+# the open + journal setup cost per request.
+
+_local = threading.local()
+
+
+def get_db():
+
+    conn = getattr(_local, "conn", None)
+
+    if conn is None:
+
+        conn = sqlite3.connect(
+            DB_PATH,
+            check_same_thread=False,
+            isolation_level=None
+        )
+
+        # Per-connection pragma (unlike WAL, it doesn't persist in the
+        # db file) — every thread's connection needs it, not just the
+        # import-time one.
+        conn.execute("PRAGMA synchronous=NORMAL")
+
+        _local.conn = conn
+
+    return conn
+
+
+def init_db():
+
+    c = get_db().cursor()
+
+    c.execute("PRAGMA journal_mode=WAL")
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            username TEXT NOT NULL,
+            password TEXT NOT NULL
+        )
+    """)
+
+    c.execute("CREATE UNIQUE INDEX IF NOT EXISTS ix_users_username ON users(username)")
+
+    c.execute("""
+        CREATE TABLE IF NOT EXISTS reports (
+            id INTEGER PRIMARY KEY AUTOINCREMENT,
+            user_id INTEGER,
+            text TEXT,
+            emotion TEXT,
+            pdf_file TEXT,
+            created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+        )
+    """)
+
+
+init_db()
+
+
+# ---------------- REPORT WRITER ----------------
+
+# Report rows go through one writer thread that drains the queue in
+# batches (up to 100 rows or 50ms of coalescing), so uploads never wait
+# on a commit fsync and burst loads share a single transaction.
+
+REPORT_QUEUE = queue.Queue()
+
+
+def _report_writer():
+
+    while True:
+
+        batch = [REPORT_QUEUE.get()]
+
+        deadline = time.monotonic() + 0.05
+
+        while len(batch) < 100:
+
+            timeout = deadline - time.monotonic()
+
+            if timeout <= 0:
+                break
+
+            try:
+                batch.append(REPORT_QUEUE.get(timeout=timeout))
+
+            except queue.Empty:
+                break
+
+        # Nothing here may escape the loop: an exception (e.g. a
+        # 'database is locked' timeout while register() holds the write
+        # lock) would kill the writer and silently strand every future
+        # report in the queue.
+        try:
+            c = get_db().cursor()
+
+            c.execute("BEGIN IMMEDIATE")
+
+            try:
+                c.executemany(
+                    "INSERT INTO reports (user_id, text, emotion, pdf_file) VALUES (?, ?, ?, ?)",
+                    batch
+                )
+                c.execute("COMMIT")
+
+            except Exception:
+                c.execute("ROLLBACK")
+                raise
+
+        except Exception:
+            app.logger.exception("report batch insert failed")
+
+
+threading.Thread(target=_report_writer, daemon=True).start()
+
+
+# ---------------- LOGIN ----------------
+
+login_manager = LoginManager(app)
+login_manager.login_view = "login"
+
+
+class User(UserMixin):
+
+    def __init__(self, id, username):
+        self.id = id
+        self.username = username
+
+
+@login_manager.user_loader
+def load_user(user_id):
+
+    c = get_db().cursor()
+
+    row = c.execute("SELECT id, username FROM users WHERE id=?", (user_id,)).fetchone()
+
+    if row:
+        return User(row[0], row[1])
+
+    return None
+
+
+# ---------------- AUTH ----------------
+
+@app.route("/register", methods=["GET", "POST"])
+def register():
+
+    if request.method == "POST":
+
+        username = request.form["username"]
+        password = request.form["password"]
+
+        c = get_db().cursor()
+
+        # Hash once at register time; login only compares digests.
+        password_hash = generate_password_hash(password)
+
+        c.execute("BEGIN IMMEDIATE")
+
+        try:
+            c.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, password_hash))
+            c.execute("COMMIT")
+
+        except sqlite3.IntegrityError:
+            c.execute("ROLLBACK")
+            return render_template("register.html", error="Username already taken")
+
+        except:
+            c.execute("ROLLBACK")
+            raise
+
+        return redirect("/login")
+
+    return render_template("register.html")
+
+
+@app.route("/login", methods=["GET", "POST"])
+def login():
+
+    if request.method == "POST":
+
+        username = request.form["username"]
+        password = request.form["password"]
+
+        c = get_db().cursor()
+
+        row = c.execute(
+            "SELECT id, username, password FROM users WHERE username=?",
+            (username,)
+        ).fetchone()
 
-# ---------------- AUDIO CONVERT ----------------
+        if row and check_password_hash(row[2], password):
+            login_user(User(row[0], row[1]))
+            return redirect("/")
 
-def convert_to_wav(input_path):
+        return render_template("login.html", error="Invalid username or password")
 
-    output_path = input_path.rsplit(".", 1)[0] + ".wav"
+    return render_template("login.html")
 
-    audio = AudioSegment.from_file(input_path)
-    audio = audio.set_channels(1)
-    audio = audio.set_frame_rate(16000)
 
-    audio.export(output_path, format="wav")
+@app.route("/logout")
+@login_required
+def logout():
 
-    return output_path
+    logout_user()
+
+    return redirect("/login")
 
 
 # ---------------- EMOTION ----------------
 
+# Keyword based emotions (strong signals), compiled once at import into a
+# single alternation so every chunk is scanned in one pass instead of four.
+# Dict order is the priority order the old per-list checks had
+# (angry > fear > sad > happy), regardless of match position.
+
+EMOTION_KEYWORDS = {
+    "angry": ["angry", "hate", "annoyed", "furious", "irritated"],
+    "fear": ["fear", "afraid", "scared", "panic", "worried"],
+    "sad": ["sad", "cry", "upset", "depressed", "lonely"],
+    "happy": ["happy", "great", "love", "excited", "awesome", "good"],
+}
+
+KEYWORD_LABELS = {
+    "angry": "Angry 😡",
+    "fear": "Fear 😨",
+    "sad": "Sad 😢",
+    "happy": "Happy 😊",
+}
+
+KEYWORD_RE = re.compile(
+    "|".join(
+        f"(?P<{name}>{'|'.join(words)})"
+        for name, words in EMOTION_KEYWORDS.items()
+    ),
+    re.IGNORECASE
+)
+
+
+# ---------------- SENTIMENT ----------------
+
+# VADER's analyzer is one shared lexicon; scoring a chunk is a single
+# dict-lookup pass with rule-based combining (negation, intensifiers),
+# and it's built for short sentence-level strings like our 5-word chunks.
+
+SENTIMENT = SentimentIntensityAnalyzer()
+
+
+def score_text(text: str) -> tuple[float, float]:
+
+    scores = SENTIMENT.polarity_scores(text)
+
+    # compound is -1..+1 like the old polarity; the non-neutral token
+    # share (1 - neu) stands in for subjectivity (0..1)
+    return scores["compound"], 1.0 - scores["neu"]
+
+
 # ---------------- SPEECH ----------------
 
-def recognize_speech(path):
+# Local CTranslate2 Whisper model (INT8), built exactly once and shared
+# by every upload — construction (weight load) never sits on a request
+# path, and import stays cheap for anything that never transcribes.
+
+_whisper_lock = threading.Lock()
+_whisper_model = None
+
+
+def get_whisper_model():
+
+    global _whisper_model
+
+    if _whisper_model is None:
+
+        with _whisper_lock:
 
-    r = sr.Recognizer()
+            if _whisper_model is None:
+                _whisper_model = WhisperModel("small.en", compute_type="int8")
 
-    with sr.AudioFile(path) as source:
-        audio = r.record(source)
+    return _whisper_model
+
+
+def recognize_speech(path):
+
+    # Returns (text, words) where words carry Whisper's real per-word
+    # start/end times, so the timeline doesn't have to invent timestamps.
 
     try:
-        return r.recognize_google(audio)
+        segments, _ = get_whisper_model().transcribe(
+            path,
+            beam_size=1,
+            vad_filter=True,
+            word_timestamps=True
+        )
+
+        words = [word for segment in segments for word in segment.words]
+
+        text = " ".join(word.word.strip() for word in words)
+
+        if not text:
+            return "Could not recognize speech", []
+
+        return text, words
 
     except:
-        return "Could not recognize speech"
+        return "Could not recognize speech", []
 
-def detect_emotion(text):
-    
-    blob = TextBlob(text)
+# Polarity buckets, replacing the old if/elif chain with one sorted
+# lookup. The negative thresholds sit one ulp above -0.5 / -0.2 so that
+# exact boundary scores still land in the sadder bucket, matching the
+# old inclusive <= comparisons. None marks the neutral bucket, where
+# subjectivity decides.
 
-    polarity = blob.sentiment.polarity      # -1 to +1
-    subjectivity = blob.sentiment.subjectivity  # 0 to 1
+POLARITY_THRESHOLDS = [
+    math.nextafter(-0.5, 1.0),
+    math.nextafter(-0.2, 1.0),
+    0.2,
+    0.5,
+]
 
-    text = text.lower()
+POLARITY_LABELS = ["Very Sad 😭", "Sad 😞", None, "Happy 🙂", "Very Happy 😄"]
 
-    # Keyword based emotions (strong signals)
-    angry_words = ["angry", "hate", "annoyed", "furious", "irritated"]
-    fear_words = ["fear", "afraid", "scared", "panic", "worried"]
-    sad_words = ["sad", "cry", "upset", "depressed", "lonely"]
-    happy_words = ["happy", "great", "love", "excited", "awesome", "good"]
 
-    # Keyword detection
-    if any(word in text for word in angry_words):
-        return "Angry 😡"
+@lru_cache(maxsize=2048)
+def detect_emotion(text: str) -> str:
 
-    if any(word in text for word in fear_words):
-        return "Fear 😨"
+    # Keyword detection: one scan over the text, then the highest-priority
+    # category that matched anywhere wins (not the leftmost match)
+    matched = {match.lastgroup for match in KEYWORD_RE.finditer(text)}
 
-    if any(word in text for word in sad_words):
-        return "Sad 😢"
+    if matched:
 
-    if any(word in text for word in happy_words):
-        return "Happy 😊"
+        for name in EMOTION_KEYWORDS:
 
-    # Sentiment based detection
-    if polarity >= 0.5:
-        return "Very Happy 😄"
+            if name in matched:
+                return KEYWORD_LABELS[name]
 
-    elif polarity >= 0.2:
-        return "Happy 🙂"
+    polarity, subjectivity = score_text(text)  # -1..+1, 0..1
 
-    elif polarity <= -0.5:
-        return "Very Sad 😭"
+    # Sentiment based detection
+    label = POLARITY_LABELS[bisect.bisect_right(POLARITY_THRESHOLDS, polarity)]
 
-    elif polarity <= -0.2:
-        return "Sad 😞"
+    if label is not None:
+        return label
 
-    elif subjectivity >= 0.6:
+    if subjectivity >= 0.6:
         return "Emotional 😔"
 
-    else:
-        return "Neutral 😐"
+    return "Neutral 😐"
 
 # ---------------- TIMELINE ----------------
 
-def split_timeline(text):
+def split_timeline(words: list) -> tuple[dict[str, list], Counter]:
 
-    words = text.split()
-    timeline = []
+    # 5-word chunks carrying the real start/end of their first and last
+    # word, instead of the old synthetic start += 3 counter. The timeline
+    # is four parallel lists rather than a dict per chunk: ~200 bytes of
+    # dict overhead per entry go away, and the counter pass collapses to
+    # one Counter() call over the emotions column.
 
-    start = 0
-    step = 3
+    starts = []
+    ends = []
+    texts = []
+    emotions = []
 
     for i in range(0, len(words), 5):
 
-        part = " ".join(words[i:i+5])
-        emo = detect_emotion(part)
+        chunk = words[i:i+5]
+        part = " ".join(word.word.strip() for word in chunk)
 
-        timeline.append({
-            "start": start,
-            "end": start + step,
-            "text": part,
-            "emotion": emo
-        })
+        starts.append(round(chunk[0].start, 1))
+        ends.append(round(chunk[-1].end, 1))
+        texts.append(part)
+        emotions.append(detect_emotion(part))
 
-        start += step
+    timeline = {
+        "starts": starts,
+        "ends": ends,
+        "texts": texts,
+        "emotions": emotions
+    }
 
-    return timeline
+    return timeline, Counter(emotions)
 
 
 # ---------------- PDF ----------------
 
 def generate_pdf(text, emotion, timeline):
 
-    filename = "report.pdf"
+    lines = [
+        f"{start} - {end} : {chunk} ({emo})"
+        for start, end, chunk, emo in zip(
+            timeline["starts"], timeline["ends"],
+            timeline["texts"], timeline["emotions"]
+        )
+    ]
+
+    # Key the report on everything it renders — transcript, verdict and
+    # the timed rows: identical reports reuse the cached file, while the
+    # same words spoken with different pacing hash differently.
+    digest = hashlib.blake2b(
+        "\n".join([text, emotion] + lines).encode(),
+        digest_size=8
+    ).hexdigest()
+
+    filename = f"report_{digest}.pdf"
     filepath = os.path.join(STATIC_FOLDER, filename)
 
+    if os.path.exists(filepath):
+        return filename
+
     c = canvas.Canvas(filepath, pagesize=A4)
 
     width, height = A4
@@ -158,16 +496,26 @@ def generate_pdf(text, emotion, timeline):
     c.drawString(50, y, "Timeline")
 
     y -= 25
-    c.setFont("Helvetica", 11)
 
-    for t in timeline:
+    line_height = 20
 
-        line = f"{t['start']} - {t['end']} : {t['text']} ({t['emotion']})"
-        c.drawString(50, y, line)
+    # One batched text object per page instead of a drawString per line
+    i = 0
 
-        y -= 20
+    while i < len(lines):
 
-        if y < 50:
+        per_page = int((y - 50) / line_height) + 1
+
+        text_obj = c.beginText(50, y)
+        text_obj.setFont("Helvetica", 11)
+        text_obj.setLeading(line_height)
+        text_obj.textLines("\n".join(lines[i:i + per_page]))
+
+        c.drawText(text_obj)
+
+        i += per_page
+
+        if i < len(lines):
             c.showPage()
             y = height - 50
 
@@ -176,9 +524,97 @@ def generate_pdf(text, emotion, timeline):
     return filename
 
 
+# ---------------- JOBS ----------------
+
+# Transcode + speech recognition + PDF run on a worker pool so /upload
+# returns immediately instead of holding a Flask worker for the whole
+# pipeline. The dashboard polls /status/<job_id> and fetches the finished
+# analysis from /result/<job_id>.
+
+EXECUTOR = ThreadPoolExecutor(max_workers=2)
+
+# job_id -> (future, submitted_at). Results are claimed once via /result;
+# jobs whose pending tab went away are swept after JOB_TTL so the table
+# doesn't grow for the life of the process.
+
+JOBS = {}
+
+JOB_TTL = 30 * 60
+
+
+def _sweep_jobs():
+
+    now = time.monotonic()
+
+    for job_id in list(JOBS):
+
+        entry = JOBS.get(job_id)
+
+        if entry is None:
+            # Claimed by /result between the snapshot and here
+            continue
+
+        job, submitted = entry
+
+        if job.done() and now - submitted > JOB_TTL:
+            JOBS.pop(job_id, None)
+
+
+def process_upload(path, filename, user_id):
+
+    # Speech to Text — Whisper decodes and resamples any container
+    # itself, streaming, so no intermediate WAV is materialized on disk.
+    text, words = recognize_speech(path)
+
+    # Emotion
+    if words:
+        timeline, emotion_count = split_timeline(words)
+
+    else:
+        # Nothing transcribed; show the sentinel text as a single chunk
+        emo = detect_emotion(text)
+
+        timeline = {
+            "starts": [0],
+            "ends": [0],
+            "texts": [text],
+            "emotions": [emo]
+        }
+
+        emotion_count = Counter([emo])
+
+    emotion = max(emotion_count, key=emotion_count.get)
+
+    chart_labels = list(emotion_count.keys())
+    chart_data = list(emotion_count.values())
+
+    # PDF
+    pdf_file = generate_pdf(text, emotion, timeline)
+
+    # Save report (batched by the writer thread)
+    REPORT_QUEUE.put((user_id, text, emotion, pdf_file))
+
+    # Escape user-derived text once here; Markup values skip Jinja's
+    # per-render autoescape. Chart payloads are serialized once too,
+    # instead of letting the template repr Python lists.
+    return {
+        "text": escape(text),
+        "emotion": emotion,
+        "timeline": list(zip(
+            timeline["starts"], timeline["ends"],
+            map(escape, timeline["texts"]), timeline["emotions"]
+        )),
+        "chart_labels": json.dumps(chart_labels),
+        "chart_data": json.dumps(chart_data),
+        "pdf_file": pdf_file,
+        "filename": filename
+    }
+
+
 # ---------------- MAIN ----------------
 
 @app.route("/")
+@login_required
 def home():
 
     return render_template("dashboard.html")
@@ -193,6 +629,7 @@ def uploaded_file(filename):
 # ---------------- UPLOAD ----------------
 
 @app.route("/upload", methods=["POST"])
+@login_required
 def upload():
 
     file = request.files.get("file")
@@ -206,42 +643,60 @@ def upload():
         path = os.path.join(app.config["UPLOAD_FOLDER"], filename)
         file.save(path)
 
-        # Convert to WAV if needed
-        if not path.lower().endswith(".wav"):
-            path = convert_to_wav(path)
+        # Everything slow happens on the worker pool
+        _sweep_jobs()
 
-        # Speech to Text
-        text = recognize_speech(path)
+        job_id = uuid.uuid4().hex
+        JOBS[job_id] = (
+            EXECUTOR.submit(process_upload, path, filename, current_user.id),
+            time.monotonic()
+        )
 
-        # Emotion
-        emotion = detect_emotion(text)
+        return render_template("pending.html", job_id=job_id)
 
-        timeline = split_timeline(text)
+    except Exception as e:
+
+        return render_template(
+            "dashboard.html",
+            error=f"Error: {str(e)}"
+        )
 
-        emotion_count = {}
 
-        for t in timeline:
-                emo = t["emotion"]
-                emotion_count[emo] = emotion_count.get(emo, 0) + 1
+@app.route("/status/<job_id>")
+@login_required
+def status(job_id):
 
-        emotion = max(emotion_count, key=emotion_count.get)
+    entry = JOBS.get(job_id)
 
-        chart_labels = list(emotion_count.keys())
-        chart_data = list(emotion_count.values())
+    if entry is None:
+        return {"state": "unknown"}, 404
 
-        # PDF
-        pdf_file = generate_pdf(text, emotion, timeline)
+    job = entry[0]
 
-        return render_template(
-            "dashboard.html",
-            text=text,
-            emotion=emotion,
-            timeline=timeline,
-            chart_labels=chart_labels,
-            chart_data=chart_data,
-            pdf_file=pdf_file,
-            filename=filename
-        )
+    if not job.done():
+        return {"state": "pending"}
+
+    if job.exception() is not None:
+        return {"state": "failed"}
+
+    return {"state": "done"}
+
+
+@app.route("/result/<job_id>")
+@login_required
+def result(job_id):
+
+    entry = JOBS.get(job_id)
+
+    if entry is None or not entry[0].done():
+        return redirect("/")
+
+    job = entry[0]
+
+    JOBS.pop(job_id, None)
+
+    try:
+        data = job.result()
 
     except Exception as e:
 
@@ -250,6 +705,8 @@ def upload():
             error=f"Error: {str(e)}"
         )
 
+    return render_template("dashboard.html", **data)
+
 
 # ---------------- RUN ----------------
 
@@ -260,5 +717,5 @@ if __name__ == "__main__":
     app.run(
         host="0.0.0.0",
         port=port,
-        debug=True
+        debug=os.environ.get("FLASK_DEBUG") == "1"
     )